@@ -2,11 +2,25 @@
 Настройки приложения по умолчанию
 """
 
+from functools import lru_cache
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     SQLALCHEMY_DATABASE_URI: str = "sqlite+aiosqlite:///main.db"
+    # создавать таблицы при запуске, при нескольких workers схема создаётся отдельно
+    CREATE_SCHEMA_ON_STARTUP: bool = True
+    # количество процессов uvicorn при запуске main.py; для SQLite только 1,
+    # иначе у каждого процесса свой пул писателя
+    WORKERS: int = 1
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Получить настройки, переменные окружения читаются один раз
+    """
+    return Settings()
+
+
+settings = get_settings()
@@ -2,16 +2,105 @@
 Модуль конфигурации к базе данных
 """
 
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from config import settings
 
-engine = create_async_engine(
-    settings.SQLALCHEMY_DATABASE_URI,
-    future=True,
-    # echo=True,
-    # isolation_level='REPEATABLE READ'
+# настройки соединения SQLite: WAL журнал позволяет читателям не блокироваться
+# писателем, synchronous=NORMAL убирает fsync на каждый commit
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("temp_store", "MEMORY"),
+    ("mmap_size", 10737418240),
+    ("cache_size", -65536),
+    ("busy_timeout", 5000),
 )
+# количество соединений, удерживаемых в пуле
+WRITER_POOL_SIZE = 1
+READER_POOL_SIZE = 4
+SERVER_POOL_SIZE = 20
+SERVER_MAX_OVERFLOW = 10
+
+
+def is_sqlite_file(url: str) -> bool:
+    """
+    Проверить, что URL указывает на файловую базу SQLite
+    """
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Применить PRAGMA к каждому новому соединению
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def make_engine(url: str, pool_size: int, max_overflow: int = 10):
+    """
+    Создать engine
+
+    Для файловой SQLite вместо NullPool используется пул постоянных соединений,
+    чтобы не терять кэш страниц соединения при каждом запросе. Для сетевых баз
+    параметры pool_size и max_overflow заменяются общими настройками пула
+    """
+    if is_sqlite_file(url):
+        pool_options = dict(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=-1,
+            pool_pre_ping=False,
+        )
+    elif make_url(url).get_backend_name() == "sqlite":
+        # база в памяти использует StaticPool диалекта
+        pool_options = {}
+    else:
+        # сетевые базы: одинаковый пул на чтение и запись, проверка разорванных соединений
+        pool_options = dict(
+            pool_size=SERVER_POOL_SIZE,
+            max_overflow=SERVER_MAX_OVERFLOW,
+            pool_recycle=300,
+            pool_pre_ping=True,
+        )
+    new_engine = create_async_engine(
+        url,
+        future=True,
+        # echo=True,
+        # isolation_level='REPEATABLE READ'
+        **pool_options
+    )
+    if is_sqlite_file(url):
+        event.listen(new_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return new_engine
+
+
+# engine для изменяющих запросов, SQLite допускает только одного писателя
+engine = make_engine(settings.SQLALCHEMY_DATABASE_URI, WRITER_POOL_SIZE, max_overflow=0)
+# engine для запросов только на чтение, для остальных баз достаточно общего пула
+if is_sqlite_file(settings.SQLALCHEMY_DATABASE_URI):
+    read_engine = make_engine(settings.SQLALCHEMY_DATABASE_URI, READER_POOL_SIZE)
+else:
+    read_engine = engine
+
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+async_read_session = sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
 Base = declarative_base()
+
+
+async def dispose_engines():
+    """
+    Закрыть соединения пулов
+    """
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
@@ -2,12 +2,19 @@
 DAL для User и для Transaction
 """
 
+from sqlalchemy import update, case, bindparam, or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
 from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy.orm import strategy_options
-from sqlalchemy.sql import selectable, or_
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.sql import selectable, union_all
+from sqlalchemy.sql.dml import Update
 from datetime import datetime
+import asyncio
+import hashlib
+import hmac
+import os
 import typing as t
 from dataclasses import dataclass
 from enum import Enum
@@ -22,6 +29,14 @@ from db.model import (
 )
 
 
+# параметры scrypt; соль и ключ вместе занимают 48 байт из 64 в User.password_hash
+PASSWORD_SALT_SIZE = 16
+PASSWORD_KEY_SIZE = 32
+PASSWORD_SCRYPT_N = 2 ** 14
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+
+
 @dataclass
 class DataRange:
     """
@@ -74,6 +89,35 @@ class RefundError(DALError):
         return f"{self.message} ({self.err})"
 
 
+def _derive_key(password: str, salt: bytes) -> bytes:
+    """
+    Ключ scrypt для пароля и соли
+    """
+    return hashlib.scrypt(
+        password.encode(), salt=salt,
+        n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P,
+        dklen=PASSWORD_KEY_SIZE
+    )
+
+
+def hash_password(password: str) -> bytes:
+    """
+    Вычислить хэш пароля
+
+    Хэш содержит случайную соль и ключ scrypt, одинаковые пароли дают разные хэши
+    """
+    salt = os.urandom(PASSWORD_SALT_SIZE)
+    return salt + _derive_key(password, salt)
+
+
+def verify_password(password: str, password_hash: bytes) -> bool:
+    """
+    Проверить пароль по сохранённому хэшу
+    """
+    salt, key = password_hash[:PASSWORD_SALT_SIZE], password_hash[PASSWORD_SALT_SIZE:]
+    return hmac.compare_digest(_derive_key(password, salt), key)
+
+
 class UserDAL:
     """
     Data access layer для пользователей
@@ -81,8 +125,13 @@ class UserDAL:
     def __init__(self, db_session: Session):
         self.db_session = db_session
 
-    def make_password_hash(self, password):
-        return "hash({})".format(password)
+    async def make_password_hash(self, password: str) -> bytes:
+        """
+        Получить хэш пароля
+
+        Вычисление хэша выполняется в пуле потоков, чтобы не блокировать event loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, hash_password, password)
 
     async def create(
         self, email: str, password: str,
@@ -94,11 +143,11 @@ class UserDAL:
         """
         new_user = User(
             first_name=first_name, surname=surname,
-            email=email, password_hash=self.make_password_hash(password),
+            email=email, password_hash=await self.make_password_hash(password),
         )
+        # user_id баланса заполняется через relationship при flush
         user_balance = Balance(user=new_user)
-        self.db_session.add(new_user)
-        self.db_session.add(user_balance)
+        self.db_session.add_all([new_user, user_balance])
         try:
             await self.db_session.flush()
         except IntegrityError:
@@ -106,19 +155,22 @@ class UserDAL:
 
         return new_user
 
-    def _filter(
-            self, q: selectable.Select, user_id, email
-    ) -> selectable.Select:
+    async def _get_by(
+            self,
+            queries: t.Dict[str, selectable.Select],
+            user_id: t.Optional[int],
+            email: t.Optional[str],
+    ) -> User:
         """
-        Отфильтровать выборку по параметрам
+        Выполнить готовый запрос пользователя по id или email
         """
-        if user_id is None and email is None:
-            raise TypeError("one of the parameters must be specified: email user_id")
         if user_id:
-            ret = q.filter(User.id == user_id)
-            return ret
+            q = await self.db_session.execute(queries["user_id"], {"user_id": user_id})
         elif email:
-            return q.filter(User.email == email)
+            q = await self.db_session.execute(queries["email"], {"email": email})
+        else:
+            raise TypeError("one of the parameters must be specified: email user_id")
+        return q.scalar()
 
     async def get_with_balance(
             self,
@@ -128,13 +180,31 @@ class UserDAL:
         """
         Получить пользователя
         """
+        return await self._get_by(_USER_WITH_BALANCE, user_id, email)
+
+    async def get_many_with_balance(
+            self,
+            ids: t.Iterable[int] = (),
+            emails: t.Iterable[str] = (),
+    ) -> t.Dict[t.Union[int, str], User]:
+        """
+        Получить пользователей с балансом по спискам id и email одним запросом
+
+        Каждый найденный пользователь доступен в результате и по id, и по email
+        """
+        ids, emails = list(ids), list(emails)
+        if not ids and not emails:
+            return {}
         q = await self.db_session.execute(
-            self._filter(
-                select(User).options(joinedload(User.balance)),
-                user_id, email
+            select(User).options(joinedload(User.balance)).where(
+                or_(User.id.in_(ids), User.email.in_(emails))
             )
         )
-        return q.unique().scalar()
+        users = {}
+        for user in q.scalars():
+            users[user.id] = user
+            users[user.email] = user
+        return users
 
     async def get_with_transactions(
             self,
@@ -144,17 +214,7 @@ class UserDAL:
         """
         Получить пользователя
         """
-        q = await self.db_session.execute(
-            self._filter(
-                select(User).options(
-                    selectinload(User.transactions).options(
-                        *TransactionDAL.full_load_transaction()
-                    )
-                ),
-                user_id, email
-            )
-        )
-        return q.scalar()
+        return await self._get_by(_USER_WITH_TRANSACTIONS, user_id, email)
 
     async def get_full(
             self,
@@ -164,20 +224,7 @@ class UserDAL:
         """
         Получить пользователя
         """
-        q = await self.db_session.execute(
-            self._filter(
-                select(User).options(
-                    selectinload(
-                        User.balance
-                    ),
-                    selectinload(User.transactions).options(
-                        *TransactionDAL.full_load_transaction(),
-                    )
-                ),
-                user_id, email
-            )
-        )
-        return q.scalar()
+        return await self._get_by(_USER_FULL, user_id, email)
 
 
 class TransactionDAL:
@@ -187,16 +234,22 @@ class TransactionDAL:
     def __init__(self, db_session: Session):
         self.db_session = db_session
 
-    async def create_refill(self, user: User, amount: float) -> Transaction:
+    def _build_refill(self, user: User, amount: float) -> Transaction:
         """
-        Создать пополнение
+        Добавить пополнение в сессию без записи в базу
         """
         new_transaction = Transaction(
             user=user, amount=amount, created_at=datetime.now(),
             resolve=None, refund=None, refunded=None
         )
-
         self.db_session.add(new_transaction)
+        return new_transaction
+
+    async def create_refill(self, user: User, amount: float) -> Transaction:
+        """
+        Создать пополнение
+        """
+        new_transaction = self._build_refill(user, amount)
         try:
             await self.db_session.flush()
         except IntegrityError:
@@ -204,6 +257,32 @@ class TransactionDAL:
 
         return new_transaction
 
+    async def create_refill_committed(self, user: User, amount: float) -> Transaction:
+        """
+        Создать подтверждённое пополнение
+
+        Транзакция с решением записывается вместе с изменением баланса без
+        отдельного вызова commit
+        """
+        new_transaction = self._build_refill(user, amount)
+        new_transaction.resolve = TransactionResolve(
+            transaction=new_transaction,
+            status=TransactionStatus.Commited,
+            resolved_at=datetime.now()
+        )
+        try:
+            # перед UPDATE сессия записывает транзакцию и решение
+            await self.db_session.execute(
+                update(Balance).where(
+                    Balance.user_id == user.id
+                ).values(amount=Balance.amount + amount).execution_options(synchronize_session=False)
+            )
+        except IntegrityError:
+            raise DALError()
+        self._expire_balances(user.id)
+
+        return new_transaction
+
     async def create_transfer(
             self, user_from: User, user_to: User, amount: float
     ) -> Transaction:
@@ -235,14 +314,42 @@ class TransactionDAL:
 
         # q.execution_options(synchronize_session="fetch", isolation_level="SERIALIZABLE")
         try:
-            if transaction.receiver:
-                transaction.receiver.balance.amount = Balance.amount + transaction.amount
-                transaction.user.balance.amount = Balance.amount - transaction.amount
-            else:
-                transaction.user.balance.amount = Balance.amount + transaction.amount
+            await self.db_session.execute(
+                self._update_balances(transaction).execution_options(synchronize_session=False)
+            )
             await self.db_session.flush()
         except IntegrityError:
             raise AttemptModifyResolved()
+        self._expire_balances(transaction.user_id, transaction.receiver_id)
+
+    def _update_balances(self, transaction: Transaction) -> Update:
+        """
+        Запрос изменения балансов участников транзакции
+
+        Арифметика выполняется на стороне базы одним UPDATE
+        """
+        q = update(Balance)
+        if transaction.receiver_id:
+            return q.where(
+                Balance.user_id.in_([transaction.user_id, transaction.receiver_id])
+            ).values(amount=case(
+                (Balance.user_id == transaction.user_id, Balance.amount - transaction.amount),
+                else_=Balance.amount + transaction.amount
+            ))
+        return q.where(
+            Balance.user_id == transaction.user_id
+        ).values(amount=Balance.amount + transaction.amount)
+
+    def _expire_balances(self, *user_ids: t.Optional[int]):
+        """
+        Сбросить загруженные в сессию балансы, изменённые в обход ORM
+        """
+        for user_id in user_ids:
+            if user_id is None:
+                continue
+            balance = self.db_session.identity_map.get(identity_key(Balance, user_id))
+            if balance is not None:
+                self.db_session.expire(balance, ["amount"])
 
     async def reject(self, transaction: Transaction):
         """
@@ -294,7 +401,8 @@ class TransactionDAL:
         if transaction.refund:
             raise RefundError(RefundErrorType.AttemptRefundToRefund)
 
-        refund_transaction = await self.create_refill(transaction.user, -transaction.amount)
+        # транзакция возврата и связь с ней записываются одним flush
+        refund_transaction = self._build_refill(transaction.user, -transaction.amount)
         transaction.refunded = TransactionRefund(
             transaction=transaction,
             linked_transaction=refund_transaction
@@ -311,28 +419,51 @@ class TransactionDAL:
     def full_load_transaction(self) -> t.Tuple[strategy_options.Load]:
         """
         Полная загрузка аттрибутов транзакции
+
+        Все связи один-к-одному, поэтому загружаются через JOIN одним запросом
         """
         return (
-            selectinload(Transaction.resolve),
-            selectinload(Transaction.refund),
-            selectinload(Transaction.refunded)
+            joinedload(Transaction.resolve),
+            joinedload(Transaction.refund),
+            joinedload(Transaction.refunded)
         )
 
     def _filter(
             self, q: selectable.Select, user: User = None,
-            transaction_id: int = None
+            transaction_id: int = None, datarange: t.Optional[DataRange] = None
     ) -> selectable.Select:
         """
         Отфильтровать выборку по параметрам
         """
         if user:
-            return q.filter(or_(
-                Transaction.user_id == user.id,
-                Transaction.receiver_id == user.id,
-            ))
+            return q.filter(Transaction.id.in_(self._user_transaction_ids(user, datarange)))
         elif transaction_id:
             return q.filter(Transaction.id == transaction_id)
 
+    def _user_transaction_ids(
+            self, user: User, datarange: t.Optional[DataRange]
+    ) -> selectable.CompoundSelect:
+        """
+        Id транзакций, в которых участвует пользователь
+
+        UNION ALL вместо OR, чтобы каждая часть использовала свой индекс
+        (участник, created_at). При заданном количестве каждая часть читает
+        индекс по порядку и останавливается на offset + count записях, внешний
+        запрос сортирует не больше удвоенного числа записей
+        """
+        branches = []
+        for column in (Transaction.user_id, Transaction.receiver_id):
+            q = select(Transaction.id).where(column == user.id)
+            if datarange and datarange.count:
+                # SQLite не допускает LIMIT в частях UNION без подзапроса
+                q = select(
+                    q.order_by(Transaction.created_at, Transaction.id)
+                    .limit(datarange.offset + datarange.count)
+                    .subquery().c.id
+                )
+            branches.append(q)
+        return union_all(*branches)
+
     def _range(
             self, q: selectable.Select, datarange: DataRange
     ) -> selectable.Select:
@@ -353,8 +484,8 @@ class TransactionDAL:
         q = await self.db_session.execute(
             self._filter(
                 select(Transaction).options(
-                    selectinload(Transaction.user).selectinload(User.balance),
-                    selectinload(Transaction.receiver).selectinload(User.balance),
+                    selectinload(Transaction.user),
+                    selectinload(Transaction.receiver),
                     *self.full_load_transaction()),
                 transaction_id=transaction_id
             )
@@ -367,16 +498,86 @@ class TransactionDAL:
         """
         Получить транзакции пользователя с учётом интервала
         """
+        q = await self.db_session.execute(self._getall_query(user, datarange))
+        return q.scalars().all()
+
+    async def getall_stream(
+            self, user: User, datarange: t.Optional[DataRange] = None
+    ) -> t.AsyncIterator[Transaction]:
+        """
+        Получать транзакции пользователя с учётом интервала по мере чтения из базы
+        """
+        q = await self.db_session.stream(self._getall_query(user, datarange))
+        async for transaction in q.scalars():
+            yield transaction
+
+    def _getall_query(
+            self, user: User, datarange: t.Optional[DataRange]
+    ) -> selectable.Select:
+        """
+        Запрос транзакций пользователя с учётом интервала
+        """
+        return self._range(
+            self._filter(
+                select(Transaction).options(*self.full_load_transaction()),
+                user=user, datarange=datarange
+            ),
+            datarange
+        ).order_by(Transaction.created_at, Transaction.id)
+
+    async def getall_summary(
+            self, user: User, datarange: t.Optional[DataRange] = None
+    ) -> t.List[dict]:
+        """
+        Получить краткие данные транзакций пользователя с учётом интервала
+
+        Возвращаются только id, amount, created_at и status без создания объектов ORM
+        """
         q = await self.db_session.execute(
             self._range(
                 self._filter(
-                    select(Transaction).options(*self.full_load_transaction()),
-                    user=user
+                    select(
+                        Transaction.id,
+                        Transaction.amount,
+                        Transaction.created_at,
+                        TransactionResolve.status
+                    ).outerjoin(TransactionResolve),
+                    user=user, datarange=datarange
                 ),
                 datarange
-            ).order_by(Transaction.created_at)
+            ).order_by(Transaction.created_at, Transaction.id)
         )
-        return q.scalars().all()
+        summary = []
+        for row in q:
+            item = row._asdict()
+            if item["status"] is None:
+                item["status"] = TransactionStatus.New
+            summary.append(item)
+        return summary
+
+
+def _user_queries(*options: strategy_options.Load) -> t.Dict[str, selectable.Select]:
+    """
+    Запросы пользователя по id и по email
+
+    Запросы строятся один раз при импорте, значения передаются параметрами
+    """
+    q = select(User).options(*options)
+    return {
+        "user_id": q.where(User.id == bindparam("user_id")),
+        "email": q.where(User.email == bindparam("email")),
+    }
+
+
+_USER_WITH_BALANCE = _user_queries(joinedload(User.balance))
+_USER_WITH_TRANSACTIONS = _user_queries(
+    selectinload(User.transactions).options(*TransactionDAL.full_load_transaction())
+)
+_USER_FULL = _user_queries(
+    # баланс загружается тем же запросом, что и пользователь
+    joinedload(User.balance),
+    selectinload(User.transactions).options(*TransactionDAL.full_load_transaction()),
+)
 
 
 class DAL:
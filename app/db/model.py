@@ -2,10 +2,15 @@
 Модели данных
 """
 
-from sqlalchemy import Integer, String, Column, Float, ForeignKey, Enum, DateTime
+from sqlalchemy import (
+        Integer, SmallInteger, String, LargeBinary, Column, Float, ForeignKey, DateTime, Index, func, literal
+)
+from sqlalchemy.future import select
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.types import TypeDecorator
 import enum
+import typing as t
 
 from db.config import Base
 
@@ -24,7 +29,7 @@ class User(Base):
     # почта как уникальный идентификатор
     email = Column(String(120), unique=True, index=True, nullable=False)
     # хэш пароля
-    password_hash = Column(String(128))
+    password_hash = Column(LargeBinary(64))
     # связанные транзакции
     transactions = relationship(
         "Transaction",
@@ -33,13 +38,15 @@ class User(Base):
         primaryjoin="""or_(
             User.id == Transaction.user_id,
             User.id == Transaction.receiver_id
-        )"""
+        )""",
+        lazy="raise_on_sql"
     )
     balance = relationship(
         "Balance",
         cascade="all,delete-orphan",
         back_populates="user",
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
 
 
@@ -57,15 +64,43 @@ class TransactionStatus(enum.Enum):
     Refund = 3
 
 
+class IntEnum(TypeDecorator):
+    """
+    Хранение значения перечисления в виде целого числа
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, enum_class: t.Type[enum.Enum]):
+        super().__init__()
+        self.enum_class = enum_class
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self.enum_class(value).value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.enum_class(value)
+
+
 class Transaction(Base):
     """
     Транзакции
     """
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # выборка транзакций пользователя упорядочивается по времени создания;
+        # те же индексы используются для поиска только по user_id/receiver_id
+        Index('ix_transactions_user_created', 'user_id', 'created_at'),
+        Index('ix_transactions_receiver_created', 'receiver_id', 'created_at'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     amount = Column(Float, nullable=False)
     created_at = Column(DateTime, nullable=False)
 
@@ -73,7 +108,8 @@ class Transaction(Base):
     resolve = relationship(
         "TransactionResolve",
         cascade="all,delete-orphan",
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
 
     # содержит refund если на неё осуществляется возврат
@@ -82,7 +118,8 @@ class Transaction(Base):
         primaryjoin="Transaction.id == TransactionRefund.transaction_id",
         cascade="all,delete-orphan",
         back_populates="transaction",
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
 
     # содержит refund если с помощью неё осуществляется возврат
@@ -91,7 +128,8 @@ class Transaction(Base):
         primaryjoin="Transaction.id == TransactionRefund.linked_transaction_id",
         cascade="all,delete-orphan",
         back_populates="linked_transaction",
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
 
     # статус транзацкии Новая (New), Подтверждённая (Commited), Отклонённная (Rejected)
@@ -101,12 +139,24 @@ class Transaction(Base):
             return self.resolve.status
         return TransactionStatus.New
 
+    # SQL выражение статуса для фильтрации в запросах без загрузки решения
+    @status.expression
+    def status(cls):
+        resolve_status = select(TransactionResolve.status).where(
+            TransactionResolve.transaction_id == cls.id
+        ).scalar_subquery()
+        return func.coalesce(
+            resolve_status,
+            literal(TransactionStatus.New, TransactionResolve.status.type)
+        )
+
     # пользователь для которого осуществляется транзакция
     user = relationship(
         "User",
         foreign_keys=[user_id],
         overlaps="transactions",
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
 
     # в случае транзакции перевода - получатель
@@ -114,7 +164,8 @@ class Transaction(Base):
         "User",
         foreign_keys=[receiver_id],
         overlaps="transactions",
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
 
 
@@ -136,12 +187,12 @@ class TransactionResolve(Base):
     )
     # принятое решение
     status = Column(
-        Enum(TransactionStatus),
+        IntEnum(TransactionStatus),
         nullable=False
     )
     # время принятия решения
     resolved_at = Column(DateTime)
-    transaction = relationship("Transaction", overlaps="resolve", uselist=False)
+    transaction = relationship("Transaction", overlaps="resolve", uselist=False, lazy="raise_on_sql")
 
 
 class TransactionRefund(Base):
@@ -163,13 +214,15 @@ class TransactionRefund(Base):
     transaction = relationship(
         "Transaction",
         foreign_keys=[transaction_id],
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
     # транзакция, с помощью которой осуществляется возврат
     linked_transaction = relationship(
         "Transaction",
         foreign_keys=[linked_transaction_id],
-        uselist=False
+        uselist=False,
+        lazy="raise_on_sql"
     )
 
 
@@ -183,4 +236,4 @@ class Balance(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True, primary_key=True)
     # баланс
     amount = Column(Float, nullable=False, default=0.0)
-    user = relationship("User", back_populates="balance", uselist=False)
+    user = relationship("User", back_populates="balance", uselist=False, lazy="raise_on_sql")
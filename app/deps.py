@@ -2,9 +2,13 @@
 Модуль зависимостей для endpoints
 """
 
-from db.config import async_session
+import typing as t
+
+from db.config import async_session, async_read_session
 from db.dal import DAL
 
+T = t.TypeVar("T")
+
 
 async def get_db():
     """
@@ -13,3 +17,17 @@ async def get_db():
     async with async_session() as session:
         async with session.begin():
             yield DAL(session)
+
+
+async def run_ro(fn: t.Callable[[DAL], t.Awaitable[T]]) -> T:
+    """
+    Выполнить чтение через DAL в новой сессии пула для чтения
+
+    Сессия не открывает транзакцию явно и закрывается до возврата результата,
+    загруженные объекты отсоединяются от неё. Соединение возвращается в пул
+    до преобразования результата в схему
+    """
+    async with async_read_session() as session:
+        result = await fn(DAL(session))
+        session.expunge_all()
+    return result
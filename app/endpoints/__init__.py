@@ -0,0 +1,5 @@
+from .router import router, helper
+from . import user, transaction
+
+# все маршруты зарегистрированы, шаблоны путей вычисляются один раз
+helper.resolve_paths()
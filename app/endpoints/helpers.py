@@ -2,6 +2,7 @@
 Вспомогательный модуль для преобразования данных из DAL в Scheme
 """
 from fastapi import APIRouter
+import typing as t
 
 from db.dal import TransactionStatus as DALTransactionStatus
 from db import model
@@ -13,39 +14,61 @@ from schemas import (
         TransactionStatus
 )
 
+# соответствие статусов DAL статусам схемы
+_STATUS_MAP = {
+    DALTransactionStatus.New: TransactionStatus.New,
+    DALTransactionStatus.Commited: TransactionStatus.Commited,
+    DALTransactionStatus.Rejected: TransactionStatus.Rejected
+}
+
 
 class Helper:
     """
     Объект для выполнения преобразования данных DAL в Schema
+
+    Данные из базы уже проверены, поэтому схемы создаются без валидации
     """
     def __init__(self, router: APIRouter):
         self.router = router
+        # шаблоны путей маршрутов по имени endpoint
+        self._path_formats: t.Dict[str, str] = {}
+
+    def resolve_paths(self):
+        """
+        Запомнить шаблоны путей всех зарегистрированных маршрутов
+        """
+        self._path_formats = {
+            route.name: route.path_format for route in self.router.routes
+        }
+
+    def path_format(self, name: str) -> str:
+        """
+        Получить шаблон пути маршрута
+        """
+        path_format = self._path_formats.get(name)
+        if path_format is None:
+            # маршрут зарегистрирован после resolve_paths
+            self.resolve_paths()
+            path_format = self._path_formats[name]
+        return path_format
 
     def url_path_for_user(self, user_id: int) -> str:
         """
         Получить url для пользователя по его id
         """
-        return self.router.url_path_for(
-            'fetch_user', **{
-                "user_id": user_id
-            }
-        )
+        return self.path_format('fetch_user').format(user_id=user_id)
 
     def url_path_for_transaction(self, transaction_id: int) -> str:
         """
         Получить url для транзакции по её id
         """
-        return self.router.url_path_for(
-            'fetch_transaction', **{
-                "transaction_id": transaction_id
-            }
-        )
+        return self.path_format('fetch_transaction').format(transaction_id=transaction_id)
 
     def get_user_ref(self, user_id: int) -> UserRef:
         """
         Получить объект ссылки на пользователя
         """
-        return UserRef(
+        return UserRef.construct(
             id=user_id,
             href=self.url_path_for_user(user_id)
         )
@@ -54,7 +77,7 @@ class Helper:
         """
         Получить объект ссылки на транзакцию
         """
-        return TransactionRef(
+        return TransactionRef.construct(
             id=transaction_id,
             href=self.url_path_for_transaction(transaction_id)
         )
@@ -63,17 +86,13 @@ class Helper:
         """
         Получить статус транзакции
         """
-        return {
-            DALTransactionStatus.New: TransactionStatus.New,
-            DALTransactionStatus.Commited: TransactionStatus.Commited,
-            DALTransactionStatus.Rejected: TransactionStatus.Rejected
-        }.get(transaction_status)
+        return _STATUS_MAP.get(transaction_status)
 
     def dbuser_to_user(self, user: model.User) -> User:
         """
         Преобразовать модель User в schemas.User
         """
-        return User(
+        return User.construct(
             id=user.id,
             email=user.email,
             surname=user.surname,
@@ -82,21 +101,50 @@ class Helper:
             href=self.url_path_for_user(user.id)
         )
 
-    def dbtransaction_to_transaction(self, transaction: model.Transaction) -> Transaction:
+    def dbtransaction_to_transaction(
+            self, transaction: model.Transaction,
+            user_refs: t.Optional[t.Dict[int, UserRef]] = None
+    ) -> Transaction:
         """
         Преобразовать db.Transaction в schemas.Transaction
+
+        user_refs - общие для нескольких транзакций ссылки на пользователей по id
         """
-        out_transaction = Transaction(
+        if user_refs is None:
+            user_refs = {}
+        out_transaction = Transaction.construct(
             id=transaction.id,
-            user=self.get_user_ref(transaction.user.id),
+            user=self._cached_user_ref(transaction.user_id, user_refs),
             amount=transaction.amount,
             status=self.get_transaction_status(transaction.status),
             href=self.url_path_for_transaction(transaction.id)
         )
-        if transaction.receiver:
-            out_transaction.receiver = self.get_user_ref(transaction.receiver.id)
+        if transaction.receiver_id:
+            out_transaction.receiver = self._cached_user_ref(transaction.receiver_id, user_refs)
         if transaction.refunded:
             out_transaction.refunded = self.get_transaction_ref(transaction.refunded.linked_transaction_id)
         if transaction.refund:
             out_transaction.refund = self.get_transaction_ref(transaction.refund.transaction_id)
         return out_transaction
+
+    def dbtransactions_to_transactions(
+            self, transactions: t.Iterable[model.Transaction]
+    ) -> t.List[Transaction]:
+        """
+        Преобразовать список db.Transaction в список schemas.Transaction
+
+        Ссылка на каждого пользователя создаётся один раз на весь список
+        """
+        user_refs: t.Dict[int, UserRef] = {}
+        return [
+            self.dbtransaction_to_transaction(x, user_refs) for x in transactions
+        ]
+
+    def _cached_user_ref(self, user_id: int, user_refs: t.Dict[int, UserRef]) -> UserRef:
+        """
+        Получить ссылку на пользователя из кэша или создать её
+        """
+        user_ref = user_refs.get(user_id)
+        if user_ref is None:
+            user_ref = user_refs[user_id] = self.get_user_ref(user_id)
+        return user_ref
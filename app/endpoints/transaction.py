@@ -22,8 +22,17 @@ from db.dal import (
 
 log = logging.getLogger("endpoints.transaction")
 
+# сообщения об ошибках возврата
+_REFUND_ERR_MSG = {
+    RefundErrorType.AttemptRefundNotResolved: "Transaction is not resolved",
+    RefundErrorType.AttemptRefundRejected: "Transaction is rejected",
+    RefundErrorType.AttemptRefundTransfer: "Transaction is transfer",
+    RefundErrorType.AttemptRefundRefunded: "Transaction already refunded",
+    RefundErrorType.AttemptRefundToRefund: "Transaction is refund"
+}
 
-@router.post("/transaction/direct", status_code=201, response_model=Transaction)
+
+@router.post("/transaction/direct", status_code=201, responses={201: {"model": Transaction}})
 async def create_direct_trasaction(
         *, transaction_in: TransactionDirectCreate,
         dal: DAL = Depends(deps.get_db)
@@ -34,20 +43,23 @@ async def create_direct_trasaction(
     try:
         transaction = await dal.transactions.create_refill(user, transaction_in.amount)
     except DALError:
-        log.exception()
+        log.exception("Failed to create transaction for user_id=%s", transaction_in.user_id)
         raise HTTPException(500, "Failed to create transaction")
     return helper.dbtransaction_to_transaction(transaction)
 
 
-@router.post("/transaction/transfer", status_code=201, response_model=Transaction)
+@router.post("/transaction/transfer", status_code=201, responses={201: {"model": Transaction}})
 async def create_transfer_trasaction(
         *, transaction_in: TransactionTransferCreate,
         dal: DAL = Depends(deps.get_db)
 ) -> dict:
-    user = await dal.users.get_with_balance(transaction_in.user_id)
+    users = await dal.users.get_many_with_balance(
+        [transaction_in.user_id, transaction_in.receiver_id]
+    )
+    user = users.get(transaction_in.user_id)
     if user is None:
         raise HTTPException(404, "User not found")
-    receiver = await dal.users.get_with_balance(transaction_in.receiver_id)
+    receiver = users.get(transaction_in.receiver_id)
     if receiver is None:
         raise HTTPException(404, "Receiver user not found")
     try:
@@ -55,20 +67,20 @@ async def create_transfer_trasaction(
             user, receiver, transaction_in.amount,
         )
     except DALError:
-        log.exception()
+        log.exception("Failed to create transaction for user_id=%s", transaction_in.user_id)
         raise HTTPException(500, "Failed to create transaction")
     return helper.dbtransaction_to_transaction(transaction)
 
 
-@router.get("/transaction/{transaction_id}", status_code=200, response_model=Transaction)
-async def fetch_transaction(*, transaction_id: int, dal: DAL = Depends(deps.get_db)) -> dict:
-    transaction = await dal.transactions.get(transaction_id)
+@router.get("/transaction/{transaction_id}", status_code=200, responses={200: {"model": Transaction}})
+async def fetch_transaction(*, transaction_id: int) -> dict:
+    transaction = await deps.run_ro(lambda dal: dal.transactions.get(transaction_id))
     if not transaction:
         raise HTTPException(404, "Transaction not found")
     return helper.dbtransaction_to_transaction(transaction)
 
 
-@router.post("/transaction/{transaction_id}/commit", status_code=201, response_model=Transaction)
+@router.post("/transaction/{transaction_id}/commit", status_code=201, responses={201: {"model": Transaction}})
 async def commit_transaction(*, transaction_id: int, dal: DAL = Depends(deps.get_db)) -> dict:
     transaction = await dal.transactions.get(transaction_id)
     if not transaction:
@@ -80,7 +92,7 @@ async def commit_transaction(*, transaction_id: int, dal: DAL = Depends(deps.get
     return helper.dbtransaction_to_transaction(transaction)
 
 
-@router.post("/transaction/{transaction_id}/reject", status_code=201, response_model=Transaction)
+@router.post("/transaction/{transaction_id}/reject", status_code=201, responses={201: {"model": Transaction}})
 async def reject_transaction(*, transaction_id: int, dal: DAL = Depends(deps.get_db)) -> dict:
     transaction = await dal.transactions.get(transaction_id)
     if not transaction:
@@ -92,7 +104,7 @@ async def reject_transaction(*, transaction_id: int, dal: DAL = Depends(deps.get
     return helper.dbtransaction_to_transaction(transaction)
 
 
-@router.post("/transaction/{transaction_id}/refund", status_code=201, response_model=Transaction)
+@router.post("/transaction/{transaction_id}/refund", status_code=201, responses={201: {"model": Transaction}})
 async def refund_transaction(*, transaction_id: int, dal: DAL = Depends(deps.get_db)) -> dict:
     transaction = await dal.transactions.get(transaction_id)
     if not transaction:
@@ -100,12 +112,5 @@ async def refund_transaction(*, transaction_id: int, dal: DAL = Depends(deps.get
     try:
         transaction = await dal.transactions.refund(transaction)
     except RefundError as e:
-        err_msg = {
-            RefundErrorType.AttemptRefundNotResolved: "Transaction is not resolved",
-            RefundErrorType.AttemptRefundRejected: "Transaction is rejected",
-            RefundErrorType.AttemptRefundTransfer: "Transaction is transfer",
-            RefundErrorType.AttemptRefundRefunded: "Transaction already refunded",
-            RefundErrorType.AttemptRefundToRefund: "Transaction is refund"
-        }.get(e.err)
-        raise HTTPException(409, err_msg)
+        raise HTTPException(409, _REFUND_ERR_MSG.get(e.err))
     return helper.dbtransaction_to_transaction(transaction)
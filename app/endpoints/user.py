@@ -11,7 +11,7 @@ import deps
 from .router import router, helper
 
 
-@router.post("/user", status_code=201, response_model=User)
+@router.post("/user", status_code=201, responses={201: {"model": User}})
 async def create_user(
         *, user_in: UserCreate, dal: DAL = Depends(deps.get_db)
 ) -> dict:
@@ -27,25 +27,27 @@ async def create_user(
     return helper.dbuser_to_user(user)
 
 
-@router.get("/user/{user_id}", status_code=200, response_model=User)
-async def fetch_user(*, user_id: int, dal: DAL = Depends(deps.get_db)) -> dict:
-    user = await dal.users.get_with_balance(user_id)
+@router.get("/user/{user_id}", status_code=200, responses={200: {"model": User}})
+async def fetch_user(*, user_id: int) -> dict:
+    user = await deps.run_ro(lambda dal: dal.users.get_with_balance(user_id))
     if not user:
         raise HTTPException(404, "User not found")
     return helper.dbuser_to_user(user)
 
 
-@router.get("/user/{user_id}/transactions", status_code=200, response_model=List[Transaction])
+@router.get("/user/{user_id}/transactions", status_code=200, responses={200: {"model": List[Transaction]}})
 async def fetch_user_transactions(
     *, user_id: int,
     skip: Optional[int] = Query(0),
-    count: Optional[int] = Query(None),
-    dal: DAL = Depends(deps.get_db)
+    count: Optional[int] = Query(None)
 ) -> List[Transaction]:
-    user = await dal.users.get_with_balance(user_id)
+    async def fetch(dal: DAL):
+        user = await dal.users.get_with_balance(user_id)
+        if not user:
+            return None, []
+        return user, await dal.transactions.getall(user, datarange=DataRange(skip, count))
+
+    user, transactions = await deps.run_ro(fetch)
     if not user:
         raise HTTPException(404, "User not found")
-    transactions = await dal.transactions.getall(user, datarange=DataRange(skip, count))
-    return [
-        helper.dbtransaction_to_transaction(x) for x in transactions
-    ]
+    return helper.dbtransactions_to_transactions(transactions)
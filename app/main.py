@@ -3,16 +3,35 @@
 """
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
-from db.config import engine, Base
+from config import settings
+from db.config import engine, Base, dispose_engines
 from endpoints import user, transaction
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 app.include_router(user.router)
 app.include_router(transaction.router)
 
 
 @app.on_event("startup")
 async def startup():
+    if not settings.CREATE_SCHEMA_ON_STARTUP:
+        return
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app", host="0.0.0.0", port=8000,
+        loop="uvloop", http="httptools",
+        workers=settings.WORKERS
+    )
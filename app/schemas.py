@@ -7,7 +7,7 @@ from enum import Enum
 from pydantic import BaseModel, EmailStr
 
 
-class TransactionStatus(Enum):
+class TransactionStatus(str, Enum):
     """
     Статус транзакции
     """
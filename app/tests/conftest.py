@@ -0,0 +1,56 @@
+"""
+Общие настройки тестов
+"""
+
+import asyncio
+import os
+
+import pytest
+from sqlalchemy.engine.url import make_url
+
+import config
+
+
+def use_worker_database():
+    """
+    Отдельный файл базы для каждого worker pytest-xdist
+    """
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    url = make_url(config.settings.SQLALCHEMY_DATABASE_URI)
+    if not worker or url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return
+    root, ext = os.path.splitext(url.database)
+    os.environ["SQLALCHEMY_DATABASE_URI"] = str(url.set(database=f"{root}_{worker}{ext}"))
+    config.get_settings.cache_clear()
+    config.settings = config.get_settings()
+
+
+# до импорта db.config, который создаёт engine по настройкам
+use_worker_database()
+
+from db.config import engine, Base, dispose_engines  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """
+    Один цикл событий на всю сессию тестов
+
+    Соединения пулов engine создаются в цикле первого теста и переиспользуются
+    остальными тестами
+    """
+    loop = asyncio.new_event_loop()
+    yield loop
+    # пулы удерживают соединения aiosqlite, без закрытия процесс не завершится
+    loop.run_until_complete(dispose_engines())
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+async def schema():
+    """
+    Создать пустые таблицы один раз на всю сессию тестов
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
@@ -12,10 +12,13 @@ client = TestClient(app)
 
 
 @pytest.fixture
-async def prepare_db():
+async def prepare_db(schema):
+    # таблицы создаются один раз на сессию, после теста удаляются только строки;
+    # SQLite без AUTOINCREMENT снова выдаёт id начиная с 1
+    yield
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+        for table in reversed(Base.metadata.sorted_tables):
+            await conn.execute(table.delete())
 
 
 @pytest.mark.asyncio
@@ -324,3 +327,39 @@ def test_fetch_user_transactions(prepare_db):
             'user': {'href': '/user/1', 'id': 1}
         }
     ]
+
+
+@pytest.mark.asyncio
+def test_fetch_after_commit(prepare_db):
+    # GET выполняется через пул читателей и должен видеть изменения POST
+    user1 = create_user1().json()
+    transaction1 = create_direct_transaction(user1, 50.0).json()
+    client.post(f'{transaction1["href"]}/commit')
+    response = client.get(transaction1["href"])
+    assert response.status_code == 200, response.content
+    assert response.json()["status"] == "commited"
+    response = client.get(user1["href"])
+    assert response.status_code == 200, response.content
+    assert response.json()["balance"] == 50.0
+
+
+@pytest.mark.asyncio
+def test_fetch_user_transfer_transactions(prepare_db):
+    user1 = create_user1().json()
+    user2 = create_user2().json()
+    create_transfer_transaction(user1, user2, 15.0)
+    for user in (user1, user2):
+        response = client.get(f'{user["href"]}/transactions')
+        assert response.status_code == 200, response.content
+        assert response.json() == [
+            {
+                'amount': 15.0,
+                'href': '/transaction/1',
+                'id': 1,
+                'receiver': {'href': '/user/2', 'id': 2},
+                'refund': None,
+                'refunded': None,
+                'status': 'new',
+                'user': {'href': '/user/1', 'id': 1}
+            }
+        ]
@@ -3,10 +3,24 @@
 """
 
 import pytest
+from sqlalchemy import event, delete, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.future import select
 from sqlalchemy.orm import Session
-from contextlib import asynccontextmanager
-
-from db.config import engine, Base, async_session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from contextlib import asynccontextmanager, contextmanager
+import typing as t
+
+from config import settings
+from db.config import (
+        engine,
+        read_engine,
+        async_session,
+        async_read_session,
+        is_sqlite_file,
+        WRITER_POOL_SIZE,
+        READER_POOL_SIZE
+)
 from db.dal import (
         UserDAL,
         NonUniqueEmail,
@@ -14,26 +28,89 @@ from db.dal import (
         AttemptModifyResolved,
         RefundError,
         RefundErrorType,
-        DataRange
+        DataRange,
+        hash_password,
+        verify_password
 )
-from db.model import TransactionResolve, TransactionStatus
+from db.model import (
+        User,
+        Balance,
+        Transaction,
+        TransactionResolve,
+        TransactionRefund,
+        TransactionStatus
+)
+
+EMAIL1 = "test1@example.org"
+EMAIL2 = "test2@example.org"
+# учётные данные пары пользователей для make_users
+USERS = ((EMAIL1, "secret"), (EMAIL2, "secret"))
+
+
+def emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
+@asynccontextmanager
+async def explicit_begin(conn: AsyncConnection):
+    """
+    Начинать транзакции соединения SQLite явным BEGIN
+
+    Драйвер sqlite3 сам начинает и завершает транзакции, что ломает SAVEPOINT.
+    Управление транзакциями драйвера отключается только для этого соединения
+    и восстанавливается до возврата соединения в пул
+    """
+    if conn.dialect.name != "sqlite":
+        yield
+        return
+    dbapi_connection = (await conn.get_raw_connection()).connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    event.listen(conn.sync_connection, "begin", emit_begin)
+    try:
+        yield
+    finally:
+        event.remove(conn.sync_connection, "begin", emit_begin)
+        dbapi_connection.isolation_level = isolation_level
 
 
 @pytest.fixture
-async def db():
-    async with engine.begin() as conn:
-        # await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
-    async with async_session() as session:
-        async with session.begin():
-            await session.execute("DELETE from users;")
-            await session.execute("DELETE from transactions;")
-            await session.execute("DELETE from balances;")
-            await session.execute("DELETE from transactions_refund;")
-            await session.execute("DELETE from transactions_resolve;")
+async def db(schema):
+    """
+    Сессия внутри внешней транзакции, которая откатывается после теста
+
+    commit сессии фиксирует только SAVEPOINT, данные теста в базе не остаются
+    """
+    async with engine.connect() as conn, explicit_begin(conn):
+        await conn.begin()
+        await conn.begin_nested()
+        session = AsyncSession(bind=conn, expire_on_commit=False)
+
+        @event.listens_for(session.sync_session, "after_transaction_end")
+        def restart_savepoint(sync_session, transaction):
+            if conn.closed:
+                return
+            if not conn.sync_connection.in_nested_transaction():
+                conn.sync_connection.begin_nested()
+
+        yield session
+        await session.close()
+        await conn.rollback()
+
+
+@pytest.fixture
+async def committed_db(schema):
+    """
+    Сессия, изменения которой фиксируются в базе и видны другим соединениям
+
+    Данные удаляются после теста
+    """
     async with async_session() as session:
-        async with session.begin():
-            yield session
+        yield session
+        await session.rollback()
+        for model in (TransactionRefund, TransactionResolve, Transaction, Balance, User):
+            await session.execute(delete(model))
+        await session.commit()
 
 
 @pytest.fixture
@@ -46,13 +123,88 @@ async def dal(db: Session):
     yield DAL(db)
 
 
+@pytest.fixture
+async def make_users(db: Session):
+    """
+    Создать пользователей с балансами одним flush
+    """
+    async def make(credentials: t.Iterable[t.Tuple[str, str]]) -> t.List[User]:
+        users = [
+            User(email=email, password_hash=hash_password(password))
+            for email, password in credentials
+        ]
+        db.add_all(users + [Balance(user=user) for user in users])
+        await db.flush()
+        return users
+    yield make
+
+
 @asynccontextmanager
 async def newdal():
-    async with async_session() as session:
+    # пул писателя содержит одно соединение, которое занято тестом
+    async with async_read_session() as session:
         async with session.begin():
             yield DAL(session)
 
 
+@contextmanager
+def count_statements():
+    """
+    Собрать SQL запросы, отправленные через engine внутри блока
+    """
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_statement)
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(
+    not is_sqlite_file(settings.SQLALCHEMY_DATABASE_URI),
+    reason="PRAGMA применяются только к файловой SQLite"
+)
+async def test_sqlite_pragmas(db: Session):
+    """
+    Тест настроек соединения SQLite
+    """
+    q = await db.execute(text("PRAGMA journal_mode"))
+    assert q.scalar() == "wal"
+    q = await db.execute(text("PRAGMA synchronous"))
+    assert q.scalar() == 1
+
+
+@pytest.mark.skipif(
+    not is_sqlite_file(settings.SQLALCHEMY_DATABASE_URI),
+    reason="пулы настраиваются только для файловой SQLite"
+)
+def test_sqlite_pools():
+    """
+    Тест пулов соединений писателя и читателей
+    """
+    assert read_engine is not engine
+    assert isinstance(engine.pool, AsyncAdaptedQueuePool)
+    assert engine.pool.size() == WRITER_POOL_SIZE
+    assert engine.pool._max_overflow == 0
+    assert isinstance(read_engine.pool, AsyncAdaptedQueuePool)
+    assert read_engine.pool.size() == READER_POOL_SIZE
+
+
+def test_is_sqlite_file():
+    """
+    Тест определения файловой базы SQLite
+    """
+    assert is_sqlite_file("sqlite+aiosqlite:///test.db")
+    assert not is_sqlite_file("sqlite+aiosqlite://")
+    assert not is_sqlite_file("sqlite+aiosqlite:///:memory:")
+    assert not is_sqlite_file("postgresql+asyncpg://user@localhost/db")
+
+
 @pytest.mark.asyncio
 async def test_userdal_create(user_dal: UserDAL):
     """
@@ -61,6 +213,11 @@ async def test_userdal_create(user_dal: UserDAL):
     user1 = await user_dal.create("test@example.org", "secret")
     # пароль не хранится в открытом виде
     assert user1.password_hash != "secret"
+    assert isinstance(user1.password_hash, bytes)
+    assert verify_password("secret", user1.password_hash)
+    assert not verify_password("wrong", user1.password_hash)
+    # соль делает хэши одинаковых паролей разными
+    assert hash_password("secret") != user1.password_hash
     # для пользователя создан баланс
     assert user1.balance.amount == 0.0
 
@@ -74,39 +231,57 @@ async def test_userdal_get_with_balance(user_dal: UserDAL):
     """
     Тест на получение пользователя с балансом по id, email
     """
-    email1 = "test1@example.org"
-    email2 = "test2@example.org"
-    user1 = await user_dal.create(email1, "secret")
-    user2 = await user_dal.create(email2, "secret")
+    user1 = await user_dal.create(EMAIL1, "secret")
+    user2 = await user_dal.create(EMAIL2, "secret")
 
     # получение пользователя с балансом по id
     user = await user_dal.get_with_balance(user1.id)
-    assert user.email == "test1@example.org"
+    assert user.email == EMAIL1
     assert user.balance.amount == 0.0
 
     user = await user_dal.get_with_balance(user2.id)
-    assert user.email == "test2@example.org"
+    assert user.email == EMAIL2
     assert user.balance.amount == 0.0
 
     # получение пользователя с балансом по email
-    user = await user_dal.get_with_balance(email=email1)
+    user = await user_dal.get_with_balance(email=EMAIL1)
     assert user.id == user1.id
     assert user.balance.amount == 0.0
 
-    user = await user_dal.get_with_balance(email=email2)
+    user = await user_dal.get_with_balance(email=EMAIL2)
     assert user.id == user2.id
     assert user.balance.amount == 0.0
 
 
 @pytest.mark.asyncio
-async def test_create_refill_transaction(dal: DAL):
+async def test_userdal_get_many_with_balance(user_dal: UserDAL):
+    """
+    Тест на получение нескольких пользователей с балансом одним запросом
+    """
+    user1 = await user_dal.create(EMAIL1, "secret")
+    user2 = await user_dal.create(EMAIL2, "secret")
+
+    users = await user_dal.get_many_with_balance([user1.id, user2.id + 1])
+    assert set(users) == {user1.id, EMAIL1}
+    assert users[user1.id].balance.amount == 0.0
+
+    # поиск по id и email в одном запросе
+    users = await user_dal.get_many_with_balance(
+        [user1.id], [EMAIL2, "test3@example.org"]
+    )
+    assert set(users) == {user1.id, user2.id, EMAIL1, EMAIL2}
+    assert users[EMAIL2] is users[user2.id]
+    assert users[user2.id].balance.amount == 0.0
+
+    assert await user_dal.get_many_with_balance() == {}
+
+
+@pytest.mark.asyncio
+async def test_create_refill_transaction(dal: DAL, make_users):
     """
     Проверка прямой транзакции
     """
-    email1 = "test1@example.org"
-    email2 = "test2@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    user2 = await dal.users.create(email2, "secret")
+    user1, user2 = await make_users(USERS)
     await dal.transactions.create_refill(user1, 35.0)
     await dal.transactions.create_refill(user2, 40.0)
 
@@ -120,14 +295,11 @@ async def test_create_refill_transaction(dal: DAL):
 
 
 @pytest.mark.asyncio
-async def test_create_transfer_transaction(dal: DAL):
+async def test_create_transfer_transaction(dal: DAL, make_users):
     """
     Проверка прямой транзакции
     """
-    email1 = "test1@example.org"
-    email2 = "test2@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    user2 = await dal.users.create(email2, "secret")
+    user1, user2 = await make_users(USERS)
     await dal.transactions.create_transfer(user1, user2, 35.0)
 
     # проверка, что транзакция перевод находится в коллекции обоих пользователей
@@ -144,26 +316,40 @@ async def test_userdal_get_full(dal: DAL):
     """
     Тест на получение пользователя с балансом по id, email
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
+    user1 = await dal.users.create(EMAIL1, "secret")
 
     await dal.transactions.create_refill(user1, 35.0)
     # получение пользователя с балансом по id
     user = await dal.users.get_full(user1.id)
-    assert user.email == "test1@example.org"
+    assert user.email == EMAIL1
     assert user.balance.amount == 0.0
     assert len(user.transactions) == 1
 
 
 @pytest.mark.asyncio
-async def test_commit_transaction(dal: DAL):
+async def test_userdal_get_full_query_count(dal: DAL):
+    """
+    Проверка, что get_full загружает пользователя со связями постоянным числом запросов
+    """
+    user1 = await dal.users.create(EMAIL1, "secret")
+    for _ in range(5):
+        transaction = await dal.transactions.create_refill_committed(user1, 35.0)
+        await dal.transactions.refund(transaction)
+
+    with count_statements() as statements:
+        user = await dal.users.get_full(user1.id)
+    assert len(user.transactions) == 10
+    assert all(x.resolve or x.refund for x in user.transactions)
+    # пользователь с балансом и транзакции со связями
+    assert len(statements) == 2, statements
+
+
+@pytest.mark.asyncio
+async def test_commit_transaction(dal: DAL, make_users):
     """
     Проверка подтверждения транзакции
     """
-    email1 = "test1@example.org"
-    email2 = "test2@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    user2 = await dal.users.create(email2, "secret")
+    user1, user2 = await make_users(USERS)
 
     assert user1.balance.amount == 0.0
     transaction = await dal.transactions.create_refill(user1, 35.0)
@@ -179,16 +365,21 @@ async def test_commit_transaction(dal: DAL):
     assert user1.balance.amount == 15.0
     assert user2.balance.amount == 20.0
 
+    # пополнение, подтверждённое при создании
+    transaction = await dal.transactions.create_refill_committed(user2, 5.0)
+    assert transaction.status == TransactionStatus.Commited
+    with pytest.raises(AttemptModifyResolved):
+        await dal.transactions.commit(transaction)
+    user2 = await dal.users.get_full(user2.id)
+    assert user2.balance.amount == 25.0
+
 
 @pytest.mark.asyncio
-async def test_reject_transaction(dal: DAL):
+async def test_reject_transaction(dal: DAL, make_users):
     """
     Проверка отклонения транзакции
     """
-    email1 = "test1@example.org"
-    email2 = "test2@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    user2 = await dal.users.create(email2, "secret")
+    user1, user2 = await make_users(USERS)
 
     assert user1.balance.amount == 0.0
     transaction = await dal.transactions.create_refill(user1, 35.0)
@@ -210,8 +401,7 @@ async def test_commit_resolved_transaction(dal: DAL):
     """
     Проверка подтверждения транзакции
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
+    user1 = await dal.users.create(EMAIL1, "secret")
 
     assert user1.balance.amount == 0.0
     transaction = await dal.transactions.create_refill(user1, 35.0)
@@ -230,8 +420,7 @@ async def test_reject_resolved_transaction(dal: DAL):
     """
     Проверка подтверждения транзакции
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
+    user1 = await dal.users.create(EMAIL1, "secret")
 
     assert user1.balance.amount == 0.0
     transaction = await dal.transactions.create_refill(user1, 35.0)
@@ -246,12 +435,12 @@ async def test_reject_resolved_transaction(dal: DAL):
 
 
 @pytest.mark.asyncio
-async def test_status_refund_refunded(dal: DAL):
+async def test_status_refund_refunded(committed_db: Session):
     """
     Проверка корректного полчения списка транзакций
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
+    dal = DAL(committed_db)
+    user1 = await dal.users.create(EMAIL1, "secret")
     transaction = await dal.transactions.create_refill(user1, 35.0)
     transaction.resolve = None
     assert transaction.status == TransactionStatus.New
@@ -276,11 +465,9 @@ async def test_refund_transaction(dal: DAL):
     """
     Проверка транзакции возврата
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
+    user1 = await dal.users.create(EMAIL1, "secret")
 
-    transaction = await dal.transactions.create_refill(user1, 35.0)
-    await dal.transactions.commit(transaction)
+    transaction = await dal.transactions.create_refill_committed(user1, 35.0)
 
     refund = await dal.transactions.refund(transaction)
     assert refund
@@ -296,8 +483,7 @@ async def test_err_refund_not_commit(dal: DAL):
     """
     Проверка выполнить возврат неподтверждённой транзакции
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
+    user1 = await dal.users.create(EMAIL1, "secret")
     transaction = await dal.transactions.create_refill(user1, 35.0)
 
     with pytest.raises(RefundError) as ex:
@@ -311,14 +497,11 @@ async def test_err_refund_not_commit(dal: DAL):
 
 
 @pytest.mark.asyncio
-async def test_err_refund_transfer(dal: DAL):
+async def test_err_refund_transfer(dal: DAL, make_users):
     """
     Проверка выполнить возврат неподтверждённой транзакции
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    email2 = "test2@example.org"
-    user2 = await dal.users.create(email2, "secret")
+    user1, user2 = await make_users(USERS)
     transaction = await dal.transactions.create_transfer(user1, user2, 35.0)
     await dal.transactions.commit(transaction)
 
@@ -332,11 +515,8 @@ async def test_err_refund_refunded(dal: DAL):
     """
     Проверка ошибок при возврате на возврат или уже возвращённую транзакцию
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    transaction = await dal.transactions.create_refill(user1, 35.0)
-
-    await dal.transactions.commit(transaction)
+    user1 = await dal.users.create(EMAIL1, "secret")
+    transaction = await dal.transactions.create_refill_committed(user1, 35.0)
     refund_transaction = await dal.transactions.refund(transaction)
 
     with pytest.raises(RefundError) as ex:
@@ -350,14 +530,11 @@ async def test_err_refund_refunded(dal: DAL):
 
 
 @pytest.mark.asyncio
-async def test_get_transactions(dal: DAL):
+async def test_get_transactions(dal: DAL, make_users):
     """
     Проверка получения транзакций пользователя
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    email2 = "test2@example.org"
-    user2 = await dal.users.create(email2, "secret")
+    user1, user2 = await make_users(USERS)
 
     transaction1 = await dal.transactions.create_refill(user1, 35.0)
     transaction2 = await dal.transactions.create_refill(user1, 40.0)
@@ -382,6 +559,9 @@ async def test_get_transactions(dal: DAL):
     assert len(transactions) == 2
     assert transactions[0].id == transaction3.id
     assert transactions[1].id == transaction4.id
+    # интервал, объединяющий записи из обеих частей выборки
+    transactions = await dal.transactions.getall(user2, DataRange(offset=1, count=1))
+    assert [x.id for x in transactions] == [transaction4.id]
 
 
 @pytest.mark.asyncio
@@ -389,15 +569,100 @@ async def test_refund_reject_refund(dal: DAL):
     """
     Проверка повторного refund после reject
     """
-    email1 = "test1@example.org"
-    user1 = await dal.users.create(email1, "secret")
-    transaction = await dal.transactions.create_refill(user1, 35.0)
-    await dal.transactions.commit(transaction)
+    user1 = await dal.users.create(EMAIL1, "secret")
+    transaction = await dal.transactions.create_refill_committed(user1, 35.0)
     refund_transaction = await dal.transactions.refund(transaction)
     await dal.transactions.reject(refund_transaction)
     transaction = await dal.transactions.get(transaction.id)
     refund_transaction = await dal.transactions.refund(transaction)
     assert refund_transaction
 
+
+@pytest.mark.asyncio
+async def test_get_transactions_query_count(dal: DAL, make_users):
+    """
+    Проверка, что количество запросов getall не зависит от количества транзакций
+    """
+    user1, user2 = await make_users(USERS)
+    for _ in range(5):
+        transaction = await dal.transactions.create_refill_committed(user1, 35.0)
+        await dal.transactions.refund(transaction)
+        await dal.transactions.create_transfer(user1, user2, 10.0)
+
+    with count_statements() as statements:
+        transactions = await dal.transactions.getall(user1)
+    assert len(transactions) == 15
+    # транзакции с JOIN на resolve/refund одним запросом
+    assert len(statements) == 1, statements
+
+
+@pytest.mark.asyncio
+async def test_get_transactions_stream(dal: DAL):
+    """
+    Проверка потокового получения транзакций пользователя
+    """
+    user1 = await dal.users.create(EMAIL1, "secret")
+    transaction1 = await dal.transactions.create_refill(user1, 35.0)
+    transaction2 = await dal.transactions.create_refill(user1, 40.0)
+    await dal.transactions.commit(transaction1)
+
+    transactions = [x async for x in dal.transactions.getall_stream(user1)]
+    assert [x.id for x in transactions] == [transaction1.id, transaction2.id]
+    assert transactions[0].status == TransactionStatus.Commited
+    transactions = [x async for x in dal.transactions.getall_stream(user1, DataRange(count=1))]
+    assert [x.id for x in transactions] == [transaction1.id]
+
+
+@pytest.mark.asyncio
+async def test_get_transactions_summary(dal: DAL):
+    """
+    Проверка получения кратких данных транзакций пользователя
+    """
+    user1 = await dal.users.create(EMAIL1, "secret")
+    transaction1 = await dal.transactions.create_refill(user1, 35.0)
+    transaction2 = await dal.transactions.create_refill(user1, 40.0)
+    await dal.transactions.commit(transaction1)
+
+    summary = await dal.transactions.getall_summary(user1)
+    assert summary == [
+        {
+            "id": transaction1.id,
+            "amount": 35.0,
+            "created_at": transaction1.created_at,
+            "status": TransactionStatus.Commited
+        },
+        {
+            "id": transaction2.id,
+            "amount": 40.0,
+            "created_at": transaction2.created_at,
+            "status": TransactionStatus.New
+        },
+    ]
+    summary = await dal.transactions.getall_summary(user1, DataRange(offset=1))
+    assert [x["id"] for x in summary] == [transaction2.id]
+
+
+@pytest.mark.asyncio
+async def test_filter_by_status(dal: DAL):
+    """
+    Проверка фильтрации транзакций по статусу на стороне базы
+    """
+    user1 = await dal.users.create(EMAIL1, "secret")
+    transaction1 = await dal.transactions.create_refill(user1, 10.0)
+    transaction2 = await dal.transactions.create_refill(user1, 20.0)
+    transaction3 = await dal.transactions.create_refill(user1, 30.0)
+    await dal.transactions.commit(transaction1)
+    await dal.transactions.reject(transaction2)
+
+    for status, transaction in (
+        (TransactionStatus.New, transaction3),
+        (TransactionStatus.Commited, transaction1),
+        (TransactionStatus.Rejected, transaction2),
+    ):
+        q = await dal.db_session.execute(
+            select(Transaction.id).where(Transaction.status == status)
+        )
+        assert q.scalars().all() == [transaction.id]
+
 # TODO: нужен тест, который проверит одновременный коммит транзакции
 # TODO: нужен тест, который проверит одновременный refund транзакции
@@ -1,4 +1,4 @@
 #!/bin/sh
 
 cd app
-SQLALCHEMY_DATABASE_URI=${SQLALCHEMY_DATABASE_URI:-sqlite+aiosqlite:///work.db} ../env/bin/uvicorn main:app
+SQLALCHEMY_DATABASE_URI=${SQLALCHEMY_DATABASE_URI:-sqlite+aiosqlite:///work.db} ../env/bin/uvicorn main:app --loop uvloop --http httptools
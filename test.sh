@@ -1,4 +1,4 @@
 #!/bin/sh
 
 cd app
-SQLALCHEMY_DATABASE_URI=sqlite+aiosqlite:///test.db ../env/bin/python -m pytest tests
+SQLALCHEMY_DATABASE_URI=${SQLALCHEMY_DATABASE_URI:-sqlite+aiosqlite:///test.db} ../env/bin/python -m pytest "$@" tests